@@ -4,13 +4,22 @@
 import argparse
 import base64
 import math
+import mmap
+import os
+import re
+import shutil
 import sys
+import tempfile
 from argparse import Namespace
-from array import array
+from collections.abc import Iterator
+from functools import cached_property, lru_cache
+from itertools import chain
 from os import path
+from typing import BinaryIO
 
-from PyQt6.QtCore import Qt, QByteArray, QBuffer, QIODeviceBase
-from PyQt6.QtGui import QImage, QPainter, QFont, QColor
+import numpy as np
+from PyQt6.QtCore import Qt, QByteArray, QBuffer, QIODeviceBase, QPointF, QSizeF
+from PyQt6.QtGui import QImage, QPainter, QFont, QColor, QStaticText, QTransform
 from PyQt6.QtWidgets import QApplication
 
 import lib_col_pic
@@ -37,6 +46,8 @@ class ElegooNeptuneThumbnails:
     """
 
     KLIPPER_THUMBNAIL_BLOCK_SIZE: int = 78
+    GCODE_SCAN_BLOCK_SIZE: int = 1024 * 1024
+    GCODE_WRITE_BLOCK_SIZE: int = 1024 * 1024
     COLORS: dict[str, QColor] = {
         "green": QColor(34, 236, 128),
         "red": QColor(209, 76, 81),
@@ -50,31 +61,71 @@ class ElegooNeptuneThumbnails:
     }
     BG_PATH: str = path.abspath(path.join(path.dirname(path.realpath(__file__)), "img"))
 
-    OLD_MODELS_ORCA: list[str] = ["Elegoo Neptune 2", "Elegoo Neptune 2D", "Elegoo Neptune 2S", "Elegoo Neptune X"]
-    OLD_MODELS: list[str] = ["NEPTUNE2", "NEPTUNE2D", "NEPTUNE2S", "NEPTUNEX"] + OLD_MODELS_ORCA
-    NEW_MODELS_ORCA: list[str] = ["Elegoo Neptune 4", "Elegoo Neptune 4 Pro", "Elegoo Neptune 4 Plus",
-                                  "Elegoo Neptune 4 Max", "Elegoo Neptune 3 Pro", "Elegoo Neptune 3 Plus",
-                                  "Elegoo Neptune 3 Max"]
-    NEW_MODELS: list[str] = ["NEPTUNE4", "NEPTUNE4PRO", "NEPTUNE4PLUS", "NEPTUNE4MAX",
-                             "NEPTUNE3PRO", "NEPTUNE3PLUS", "NEPTUNE3MAX"] + NEW_MODELS_ORCA
-    B64JPG_MODELS: list[str] = ["ORANGESTORMGIGA"]
+    OLD_MODELS_ORCA: frozenset[str] = frozenset({"Elegoo Neptune 2", "Elegoo Neptune 2D", "Elegoo Neptune 2S",
+                                                 "Elegoo Neptune X"})
+    OLD_MODELS: frozenset[str] = frozenset({"NEPTUNE2", "NEPTUNE2D", "NEPTUNE2S", "NEPTUNEX"}) | OLD_MODELS_ORCA
+    NEW_MODELS_ORCA: frozenset[str] = frozenset({"Elegoo Neptune 4", "Elegoo Neptune 4 Pro", "Elegoo Neptune 4 Plus",
+                                                 "Elegoo Neptune 4 Max", "Elegoo Neptune 3 Pro",
+                                                 "Elegoo Neptune 3 Plus", "Elegoo Neptune 3 Max"})
+    NEW_MODELS: frozenset[str] = frozenset({"NEPTUNE4", "NEPTUNE4PRO", "NEPTUNE4PLUS", "NEPTUNE4MAX",
+                                            "NEPTUNE3PRO", "NEPTUNE3PLUS", "NEPTUNE3MAX"}) | NEW_MODELS_ORCA
+    B64JPG_MODELS: frozenset[str] = frozenset({"ORANGESTORMGIGA"})
+    SUPPORTED_MODELS: frozenset[str] = OLD_MODELS | NEW_MODELS | B64JPG_MODELS
+
+    # Mapping of slice data to extract from gcode comments
+    # Example
+    # "; max_z_height: 1.40"
+    # "; filament used [g] = 12.94"
+    # "; total filament cost = 0.26"
+    # "; estimated printing time (normal mode) = 32m 11s"
+    # "; printer_model = Elegoo Neptune 4 Pro"
+    SLICE_DATA_ATTRIBUTES: dict[str, str] = {
+        "max_z_height: ": "model_height",
+        "filament used [g] = ": "filament_grams",
+        "total filament cost = ": "filament_cost",
+        "estimated printing time (normal mode) = ": "time",
+        "printer_model = ": "printer_model"
+    }
+    SLICE_DATA_PATTERN: re.Pattern = re.compile(
+        f"; ({'|'.join(re.escape(attribute) for attribute in SLICE_DATA_ATTRIBUTES)})(.*)")
 
     def __init__(self):
         args: Namespace = self._parse_args()
         self._gcode: str = args.gcode
-        self._printer_model: str = args.printer
+        self._printer: str = args.printer
         self._currency: str = args.currency
-        self._thumbnail: QImage = self._get_q_image_thumbnail()
 
-        # Get slice data
-        self._slice_data: SliceData = self._get_slice_data()
+    @cached_property
+    def _source_thumbnail(self) -> QImage:
+        """
+        Thumbnail from gcode in its original resolution, only parsed when needed
+        """
+        return self._get_q_image_thumbnail()
+
+    @cached_property
+    def _thumbnail(self) -> QImage:
+        """
+        Thumbnail from gcode scaled to fit into the metadata thumbnail
+        """
+        return self._source_thumbnail.scaled(600, 600, Qt.AspectRatioMode.KeepAspectRatio)
+
+    @cached_property
+    def _slice_data(self) -> SliceData:
+        """
+        Slice data from gcode, only parsed when needed
+        """
+        return self._get_slice_data()
 
-        # Find printer model from gcode if not set
-        if not self._printer_model or self._printer_model not in (
-                self.OLD_MODELS + self.NEW_MODELS + self.B64JPG_MODELS):
+    @cached_property
+    def _printer_model(self) -> str:
+        """
+        Printer model from arguments, found in gcode if not set
+        """
+        if not self._printer or self._printer not in self.SUPPORTED_MODELS:
             if self._slice_data.printer_model is None:
                 Exception("Printer model not found")
-            self._printer_model = self._slice_data.printer_model
+            return self._slice_data.printer_model
+        return self._printer
 
     @classmethod
     def _parse_args(cls) -> Namespace:
@@ -92,27 +143,97 @@ class ElegooNeptuneThumbnails:
         parser.add_argument("gcode", help="Gcode path provided by OrcaSlicer", type=str)
         return parser.parse_args()
 
-    def _get_base64_thumbnail(self, min_size: int = 300) -> str:
+    @classmethod
+    def _is_in_thumbnail_block(cls, line: str, in_thumbnail_block: bool) -> bool:
+        """
+        Check if a gcode line belongs to a thumbnail block, given whether the previous line did
+        """
+        if line.startswith("; thumbnail"):
+            if " begin " in line:
+                return True
+            if line.endswith(" end"):
+                return False
+        return in_thumbnail_block
+
+    @classmethod
+    def _read_line_blocks(cls, file: BinaryIO, end: int) -> Iterator[list[str]]:
+        """
+        Read blocks of whole lines from the current file position until the first line boundary at or after end
+        Reading is extended until an open thumbnail block ends, so thumbnails are never cut
+        """
+        # Binary lines only end at "\n", so for a file with bare "\r" line endings the first block is the whole file
+        position: int = file.tell()
+        in_thumbnail_block: bool = False
+        while position < end or in_thumbnail_block:
+            raw_block: bytes = file.read(max(min(end - position, cls.GCODE_SCAN_BLOCK_SIZE), 1))
+            if not raw_block:
+                break
+            if not raw_block.endswith(b"\n"):
+                raw_block += file.readline()
+            position += len(raw_block)
+            lines: list[str] = raw_block.decode("utf8").splitlines()
+            # Lines are only checked one by one if the block contains a thumbnail comment
+            if in_thumbnail_block or b"; thumbnail" in raw_block:
+                for line in lines:
+                    in_thumbnail_block = cls._is_in_thumbnail_block(line, in_thumbnail_block)
+            yield lines
+
+    def _iter_gcode_blocks(self) -> Iterator[list[str]]:
+        """
+        Iterate blocks of gcode lines, starting with header and footer (where slicers put thumbnails and metadata) and
+        only continuing with the print moves in between if the caller didn't find what it was looking for
+        Thumbnail blocks are always yielded in full, so header and middle are extended until an open one ends
+        Because the footer comes before the middle, footer lines win over middle lines for "first occurrence" searches
+        """
+        # The file is read binary to be able to seek to the footer
+        with open(self._gcode, "rb") as file:
+            # Yield header
+            yield from self._read_line_blocks(file, self.GCODE_SCAN_BLOCK_SIZE)
+            head_end: int = file.tell()
+
+            # Find footer start on a line boundary
+            file_end: int = file.seek(0, os.SEEK_END)
+            tail_start: int = file_end - self.GCODE_SCAN_BLOCK_SIZE
+            if tail_start > head_end:
+                file.seek(tail_start - 1)
+                tail_start += len(file.readline()) - 1
+            else:
+                tail_start = head_end
+
+            # Yield footer
+            file.seek(tail_start)
+            yield from self._read_line_blocks(file, file_end)
+
+            # Yield the rest, continuing into the footer if a thumbnail block crosses its start
+            file.seek(head_end)
+            yield from self._read_line_blocks(file, tail_start)
+
+    def _iter_gcode_lines(self) -> Iterator[str]:
+        """
+        Iterate gcode lines in the order of _iter_gcode_blocks
+        """
+        return chain.from_iterable(self._iter_gcode_blocks())
+
+    def _get_base64_thumbnail(self, min_size: int = 300) -> bytes:
         """
         Read the base64 encoded thumbnail from gcode file
         """
         # Try to find thumbnail
         found: bool = False
-        base64_thumbnail: str = ""
-        with open(self._gcode, "r", encoding="utf8") as file:
-            for line in file.read().splitlines():
-                if not found and line.startswith("; thumbnail begin "):
-                    parts: list[str] = line.split(" ")
-                    parts_two: list[str] = []
-                    for part in [p.split("x") for p in parts]:
-                        parts_two += part
-                    width, height = map(int, parts_two[3:5])
-                    if width >= min_size and height >= min_size:
-                        found = True
-                elif found and line == "; thumbnail end":
-                    return base64_thumbnail
-                elif found:
-                    base64_thumbnail += line[2:]
+        base64_chunks: list[bytes] = []
+        for line in self._iter_gcode_lines():
+            if not found and line.startswith("; thumbnail begin "):
+                parts: list[str] = line.split(" ")
+                parts_two: list[str] = []
+                for part in [p.split("x") for p in parts]:
+                    parts_two += part
+                width, height = map(int, parts_two[3:5])
+                if width >= min_size and height >= min_size:
+                    found = True
+            elif found and line == "; thumbnail end":
+                return b"".join(base64_chunks)
+            elif found:
+                base64_chunks.append(line[2:].encode("ascii", "ignore"))
 
         # If not found, raise exception
         raise Exception(
@@ -123,46 +244,27 @@ class ElegooNeptuneThumbnails:
         Read the base64 encoded thumbnail from gcode file and parse it to a QImage object
         """
         # Read thumbnail
-        base64_thumbnail: str = self._get_base64_thumbnail(min_size=300)
+        base64_thumbnail: bytes = self._get_base64_thumbnail(min_size=300)
 
         # Parse thumbnail
         thumbnail = QImage()
-        thumbnail.loadFromData(base64.decodebytes(bytes(base64_thumbnail, "UTF-8")), "PNG")
-        thumbnail = thumbnail.scaled(600, 600, Qt.AspectRatioMode.KeepAspectRatio)
+        thumbnail.loadFromData(base64.b64decode(base64_thumbnail), "PNG")
         return thumbnail
 
     def _get_slice_data(self) -> SliceData:
         """
         Read slice data from gcode file
         """
-        # Mapping of data to extract
-        attribute_mapping: dict[str, str] = {
-            "max_z_height: ": "model_height",
-            "filament used [g] = ": "filament_grams",
-            "total filament cost = ": "filament_cost",
-            "estimated printing time (normal mode) = ": "time",
-            "printer_model = ": "printer_model"
-        }
-
-        # Example
-        # "; max_z_height: 1.40"
-        # "; filament used [g] = 12.94"
-        # "; total filament cost = 0.26"
-        # "; estimated printing time (normal mode) = 32m 11s"
-        # "; printer_model = Elegoo Neptune 4 Pro"
-
         # Dict to store extracted data
         attributes: dict[str, str] = {}
 
-        # Try to find all attributes
-        with open(self._gcode, "r", encoding="utf8") as file:  # TODO: Optimize search
-            for line in file.read().splitlines():
-                if line.startswith("; "):
-                    for attribute in list(attribute_mapping.keys()):
-                        prefix = f"; {attribute}"
-                        if line.startswith(prefix):
-                            attributes[attribute_mapping[attribute]] = line[len(prefix):]
-                            del attribute_mapping[attribute]
+        # Try to find all attributes, the first occurrence of each one is used
+        for line in self._iter_gcode_lines():
+            match: re.Match = self.SLICE_DATA_PATTERN.match(line)
+            if match:
+                attributes.setdefault(self.SLICE_DATA_ATTRIBUTES[match.group(1)], match.group(2))
+                if len(attributes) == len(self.SLICE_DATA_ATTRIBUTES):
+                    break
 
         # Parse extracted data
         time: str = attributes.get("time", None)
@@ -197,6 +299,15 @@ class ElegooNeptuneThumbnails:
             currency=self._currency
         )
 
+    def has_thumbnail_prefix(self) -> bool:
+        """
+        Check if the gcode file already contains a thumbnail prefix, without reading the whole file into memory
+        """
+        if path.getsize(self._gcode) == 0:
+            return False
+        with open(self._gcode, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as g_code:
+            return re.search(rb";[gs]image:", g_code) is not None
+
     def is_supported_printer(self) -> bool:
         """
         Check if printer is supported
@@ -227,16 +338,40 @@ class ElegooNeptuneThumbnails:
         """
         # Prepare background
         background: QImage = QImage(900, 900, QImage.Format.Format_RGBA8888)
+        background.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(background)
         if bg_image_path is not None:
-            painter = QPainter(background)
-            painter.drawImage(0, 0, QImage(bg_image_path))
-            painter.end()
+            painter.drawImage(0, 0, self._get_background_image(bg_image_path))
 
         # Paint foreground on background
-        painter = QPainter(background)
-        painter.drawImage(150, 160, self._thumbnail)
+        painter.drawImage(0, 0, self._render_foreground_layer(is_light_background))
         painter.end()
 
+        # Return thumbnail
+        return background
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _get_background_image(cls, bg_image_path: str) -> QImage:
+        """
+        Load a background image, each one is only loaded once (QImage is implicitly shared, so reuse is cheap)
+        """
+        return QImage(bg_image_path)
+
+    @cached_property
+    def _metadata_font(self) -> QFont:
+        """
+        Font of the metadata texts, sized in pixels (60pt at 100 DPI) to not depend on the screen DPI
+        """
+        font: QFont = QFont("Arial")
+        font.setPixelSize(83)
+        return font
+
+    @cached_property
+    def _metadata_texts(self) -> list[QStaticText]:
+        """
+        Metadata text lines, laid out once and reused for every rendered layer
+        """
         # Generate option lines
         lines: list[str] = []
 
@@ -265,27 +400,45 @@ class ElegooNeptuneThumbnails:
         else:
             lines.append(f"⛁ {round(self._slice_data.filament_cost, 2):.02f}{self._slice_data.currency}")
 
-        # Add options
-        app = QApplication(sys.argv)  # Trick to make QT not crash on painter.drawText (it needs a QApplication)
-        painter = QPainter(background)
-        font = QFont("Arial", 60)
-        painter.setFont(font)
+        # Lay out lines, the pixel sized font makes the layout match any target image regardless of device DPI
+        static_texts: list[QStaticText] = []
+        for line in lines:
+            static_text: QStaticText = QStaticText(line)
+            static_text.setTextFormat(Qt.TextFormat.PlainText)
+            static_text.prepare(QTransform(), self._metadata_font)
+            static_texts.append(static_text)
+        return static_texts
+
+    @lru_cache(maxsize=None)
+    def _render_foreground_layer(self, is_light_background: bool = False) -> QImage:
+        """
+        Render thumbnail and metadata on a transparent layer, it is only rendered once per text color
+        """
+        # Paint thumbnail on transparent layer
+        foreground: QImage = QImage(900, 900, QImage.Format.Format_RGBA8888)
+        foreground.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(foreground)
+        painter.drawImage(150, 160, self._thumbnail)
+        painter.end()
+
+        # Add options, aligned left/right and vertically centered in their 400x100 boxes
+        painter = QPainter(foreground)
+        painter.setFont(self._metadata_font)
         if is_light_background:
             painter.setPen(self.COLORS["darker_gray"])
         else:
             painter.setPen(self.COLORS["own_gray"])
-        for i, line in enumerate(lines):
-            if line:
+        for i, static_text in enumerate(self._metadata_texts):
+            if static_text.text():
                 left: bool = i % 2 == 0
                 top: bool = i < 2
-                painter.drawText(30 if left else 470,
-                                 20 if top else 790, 400, 100,
-                                 (Qt.AlignmentFlag.AlignLeft if left else Qt.AlignmentFlag.AlignRight) +
-                                 Qt.AlignmentFlag.AlignVCenter, line)
+                size: QSizeF = static_text.size()
+                painter.drawStaticText(QPointF(30 if left else 470 + 400 - size.width(),
+                                               (20 if top else 790) + (100 - size.height()) / 2), static_text)
         painter.end()
 
-        # Return thumbnail
-        return background
+        # Return layer
+        return foreground
 
     def _generate_gcode_prefix(self) -> str:
         """
@@ -301,20 +454,20 @@ class ElegooNeptuneThumbnails:
                 bg_image_path=path.join(self.BG_PATH, "bg_old.png"))
             gcode_prefix += self._parse_thumbnail_old(metadata_thumbnail_background, 100, 100, "simage")
             gcode_prefix += self._parse_thumbnail_old(metadata_thumbnail_background, 200, 200, ";gimage")
-            gcode_prefix += self._parse_thumbnails_klipper(self._thumbnail, metadata_thumbnail)
+            gcode_prefix += self._parse_thumbnails_klipper(self._source_thumbnail, metadata_thumbnail)
         elif self._is_new_thumbnail():
             metadata_thumbnail_background: QImage = self._add_thumbnail_metadata(
                 bg_image_path=path.join(self.BG_PATH, "bg_new.png"))
             gcode_prefix += self._parse_thumbnail_new(metadata_thumbnail_background, 200, 200, "gimage")
             gcode_prefix += self._parse_thumbnail_new(metadata_thumbnail_background, 160, 160, "simage")
-            gcode_prefix += self._parse_thumbnails_klipper(self._thumbnail, metadata_thumbnail)
+            gcode_prefix += self._parse_thumbnails_klipper(self._source_thumbnail, metadata_thumbnail)
         elif self._is_b64jpg_thumbnail():
             metadata_thumbnail_background: QImage = self._add_thumbnail_metadata(is_light_background=True,
                                                                                  bg_image_path=path.join(self.BG_PATH,
                                                                                                          "bg_orangestorm.png"))
             gcode_prefix += self._parse_thumbnail_b64jpg(metadata_thumbnail_background, 400, 400, "gimage")
             gcode_prefix += self._parse_thumbnail_b64jpg(metadata_thumbnail_background, 114, 114, "simage")
-            gcode_prefix += self._parse_thumbnails_klipper(self._thumbnail, metadata_thumbnail)
+            gcode_prefix += self._parse_thumbnails_klipper(self._source_thumbnail, metadata_thumbnail)
         if gcode_prefix:
             gcode_prefix += '\r; Thumbnail generated by the ElegooNeptuneThumbnails-Prusa post processing script (https://github.com/Molodos/ElegooNeptuneThumbnails-Prusa)' \
                             '\r; Just mentioning "Cura_SteamEngine X.X" to trick printer into thinking this is Cura gcode\r\r'
@@ -324,130 +477,130 @@ class ElegooNeptuneThumbnails:
 
     def add_thumbnail_prefix(self) -> None:
         """
-        Adds thumbnail prefix to the gcode file if thumbnail doesn't already exist
+        Adds thumbnail prefix to the gcode file, callers check has_thumbnail_prefix first
         """
-        # Get gcode
-        g_code: str
-        with open(self._gcode, "r", encoding="utf8") as file:
-            g_code: str = file.read()
-
-        # Censor original slicer
-        g_code = g_code.replace("PrusaSlicer", "CensoredSlicer")
-        g_code = g_code.replace("OrcaSlicer", "CensoredSlicer")
-
-        # Disable original thumbnail
-        g_code = g_code.replace("; thumbnail begin ", "; orig_thumbnail begin ")
+        # Generate prefix
+        gcode_prefix: str = self._generate_gcode_prefix()
 
-        # Add prefix
-        if ';gimage:' not in g_code and ';simage:' not in g_code:
-            gcode_prefix: str = self._generate_gcode_prefix()
-            with open(self._gcode, "w", encoding="utf8") as file:
-                file.write(gcode_prefix + g_code)
+        # Write prefix and gcode to a temporary file next to the gcode and replace the gcode with it
+        # The temporary file doesn't end with .gcode, so watched upload folders don't pick it up as a print
+        temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=f"{path.basename(self._gcode)}.",
+                                              dir=path.dirname(path.abspath(self._gcode)))
+        try:
+            # The temporary file is opened first, so its descriptor is closed even if opening the gcode fails
+            with open(temp_fd, "w", encoding="utf8") as target, \
+                    open(self._gcode, "r", encoding="utf8") as source:
+                target.write(gcode_prefix)
+                # Process blocks of whole lines, so no replaced text can be split between two blocks
+                for lines in iter(lambda: source.readlines(self.GCODE_WRITE_BLOCK_SIZE), []):
+                    g_code: str = "".join(lines)
+
+                    # Censor original slicer
+                    g_code = g_code.replace("PrusaSlicer", "CensoredSlicer")
+                    g_code = g_code.replace("OrcaSlicer", "CensoredSlicer")
+
+                    # Disable original thumbnail
+                    g_code = g_code.replace("; thumbnail begin ", "; orig_thumbnail begin ")
+                    target.write(g_code)
+            shutil.copymode(self._gcode, temp_path)
+            os.replace(temp_path, self._gcode)
+        except BaseException:
+            os.remove(temp_path)
+            raise
 
     @classmethod
     def _parse_thumbnails_klipper(cls, small_icon: QImage, big_icon: QImage) -> str:
         """
-        Generate klipper thumbnail gcode for thumbnails in sizes 32x32 and 300x300
+        Generate klipper thumbnail gcode for thumbnails fitting into 32x32 and 300x300, each scaled in a single smooth step
+        The aspect ratio is kept, so non-square sources result in non-square thumbnails instead of stretched ones
         """
         g_code: str = "\r"
-        for icon in [small_icon.scaled(32, 32), big_icon.scaled(300, 300)]:
+        for icon in [small_icon.scaled(32, 32, Qt.AspectRatioMode.KeepAspectRatio,
+                                       Qt.TransformationMode.SmoothTransformation),
+                     big_icon.scaled(300, 300, Qt.AspectRatioMode.KeepAspectRatio,
+                                     Qt.TransformationMode.SmoothTransformation)]:
             byte_array: QByteArray = QByteArray()
             byte_buffer: QBuffer = QBuffer(byte_array)
             byte_buffer.open(QIODeviceBase.OpenModeFlag.WriteOnly)
-            icon.save(byte_buffer, "PNG")
-            base64_string: str = str(byte_array.toBase64().data(), "UTF-8")
-            g_code += f"; thumbnail begin {icon.width()} {icon.height()} {len(base64_string)}\r"
-            while base64_string:
-                g_code += f"; {base64_string[0:cls.KLIPPER_THUMBNAIL_BLOCK_SIZE]}\r"
-                base64_string = base64_string[cls.KLIPPER_THUMBNAIL_BLOCK_SIZE:]
+            icon.save(byte_buffer, "PNG", 0)  # Quality 0 is the strongest PNG compression
+            base64_bytes: bytes = byte_array.toBase64().data()
+            blocks: list[bytes] = [base64_bytes[k:k + cls.KLIPPER_THUMBNAIL_BLOCK_SIZE]
+                                   for k in range(0, len(base64_bytes), cls.KLIPPER_THUMBNAIL_BLOCK_SIZE)]
+            g_code += f"; thumbnail begin {icon.width()} {icon.height()} {len(base64_bytes)}\r"
+            g_code += b"".join(b"; " + block + b"\r" for block in blocks).decode("ascii")
             g_code += "; thumbnail end\r\r"
         return g_code
 
+    @classmethod
+    def _get_rgb565(cls, img: QImage) -> np.ndarray:
+        """
+        Convert an image to a height x width array of RGB565 pixel values
+        """
+        rgba_image: QImage = img.convertToFormat(QImage.Format.Format_RGBA8888)
+        ptr = rgba_image.constBits()
+        ptr.setsize(rgba_image.sizeInBytes())
+        pixels: np.ndarray = np.frombuffer(ptr, dtype=np.uint8).reshape(
+            rgba_image.height(), rgba_image.bytesPerLine())[:, :rgba_image.width() * 4].reshape(
+            rgba_image.height(), rgba_image.width(), 4)
+        return (((pixels[..., 0] & 0xF8).astype(np.uint16) << 8) |
+                ((pixels[..., 1] & 0xFC).astype(np.uint16) << 3) |
+                (pixels[..., 2] >> 3))
+
     @classmethod
     def _parse_thumbnail_old(cls, img: QImage, width: int, height: int, img_type: str) -> str:
         """
         Parse thumbnail to string for old printers
-        TODO: Maybe optimize at some time
         """
         img_type = f";{img_type}:"
-        result = ""
         b_image = img.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio)
-        img_size = b_image.size()
-        result += img_type
-        datasize = 0
-        for i in range(img_size.height()):
-            for j in range(img_size.width()):
-                pixel_color = b_image.pixelColor(j, i)
-                r = pixel_color.red() >> 3
-                g = pixel_color.green() >> 2
-                b = pixel_color.blue() >> 3
-                rgb = (r << 11) | (g << 5) | b
-                str_hex = "%x" % rgb
-                if len(str_hex) == 3:
-                    str_hex = '0' + str_hex[0:3]
-                elif len(str_hex) == 2:
-                    str_hex = '00' + str_hex[0:2]
-                elif len(str_hex) == 1:
-                    str_hex = '000' + str_hex[0:1]
-                if str_hex[2:4] != '':
-                    result += str_hex[2:4]
-                    datasize += 2
-                if str_hex[0:2] != '':
-                    result += str_hex[0:2]
-                    datasize += 2
-                if datasize >= 50:
-                    datasize = 0
-            # if i != img_size.height() - 1:
-            result += '\rM10086 ;'
-            if i == img_size.height() - 1:
-                result += "\r"
-        return result
+        row_length: int = b_image.width() * 4
+
+        # Encode each pixel as little endian RGB565 hex and terminate every row with a M10086 command
+        hex_string: str = cls._get_rgb565(b_image).astype("<u2").tobytes().hex()
+        rows: list[str] = [hex_string[k:k + row_length] for k in range(0, len(hex_string), row_length)]
+        return img_type + "".join(f"{row}\rM10086 ;" for row in rows) + "\r"
+
+    @classmethod
+    def _split_image_lines(cls, data: bytes, img_type: str, each_max: int, max_line: int) -> str:
+        """
+        Split encoded image data into gcode lines of at most each_max characters, each prefixed with the image type
+        """
+        img_type_bytes: bytes = img_type.encode("latin1")
+        lines: list[bytes] = []
+        for k in range(0, len(data), each_max):
+            if k == max_line * each_max:
+                lines.append(b'\r;' + img_type_bytes)
+            elif k == 0:
+                lines.append(img_type_bytes)
+            else:
+                lines.append(b'\r' + img_type_bytes)
+            lines.append(data[k:k + each_max])
+        return b"".join(lines).decode("latin1")
 
     @classmethod
     def _parse_thumbnail_new(cls, img: QImage, width: int, height: int, img_type: str) -> str:
         """
         Parse thumbnail to string for new printers
-        TODO: Maybe optimize at some time
         """
         img_type = f";{img_type}:"
 
-        result = ""
         b_image = img.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio)
         img_size = b_image.size()
-        color16 = array('H')
         try:
-            for i in range(img_size.height()):
-                for j in range(img_size.width()):
-                    pixel_color = b_image.pixelColor(j, i)
-                    r = pixel_color.red() >> 3
-                    g = pixel_color.green() >> 2
-                    b = pixel_color.blue() >> 3
-                    rgb = (r << 11) | (g << 5) | b
-                    color16.append(rgb)
+            # Hand the RGB565 buffer to the encoder without copying, a memoryview indexes as fast as an array('H')
+            color16: memoryview = memoryview(np.ascontiguousarray(cls._get_rgb565(b_image)).ravel())
             output_data = bytearray(img_size.height() * img_size.width() * 10)
             result_int = lib_col_pic.ColPic_EncodeStr(color16, img_size.height(), img_size.width(), output_data,
                                                       img_size.height() * img_size.width() * 10, 1024)
 
-            data0 = str(output_data).replace('\\x00', '')
-            data1 = data0[2:len(data0) - 2]
+            # Length of the data as originally measured on str(output_data) stripped of zero bytes, which includes
+            # 10 characters of the "bytearray(b'...')" wrapper
+            data_len: int = len(output_data) - output_data.count(0) + 10
             each_max = 1024 - 8 - 1
-            max_line = int(len(data1) / each_max)
-            append_len = each_max - 3 - int(len(data1) % each_max) + 10
-            j = 0
-            for i in range(len(output_data)):
-                if output_data[i] != 0:
-                    if j == max_line * each_max:
-                        result += '\r;' + img_type + chr(output_data[i])
-                    elif j == 0:
-                        result += img_type + chr(output_data[i])
-                    elif j % each_max == 0:
-                        result += '\r' + img_type + chr(output_data[i])
-                    else:
-                        result += chr(output_data[i])
-                    j += 1
-            result += '\r;'
-            for m in range(append_len):
-                result += '0'
+            max_line = data_len // each_max
+            append_len = each_max - 3 - data_len % each_max + 10
+            encoded: bytes = output_data.translate(None, b"\x00")
+            result = cls._split_image_lines(encoded, img_type, each_max, max_line) + '\r;' + '0' * append_len
 
         except Exception as e:
             raise e
@@ -458,11 +611,9 @@ class ElegooNeptuneThumbnails:
     def _parse_thumbnail_b64jpg(cls, img: QImage, width: int, height: int, img_type: str) -> str:
         """
         Parse thumbnail to string for new printers
-        TODO: Maybe optimize at some time
         """
         img_type = f";{img_type}:"
 
-        result = ""
         b_image = img.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio)
 
         try:
@@ -470,20 +621,12 @@ class ElegooNeptuneThumbnails:
             byte_buffer: QBuffer = QBuffer(byte_array)
             byte_buffer.open(QIODeviceBase.OpenModeFlag.WriteOnly)
             b_image.save(byte_buffer, "JPEG")
-            base64_string: str = str(byte_array.toBase64().data(), "UTF-8")
+            base64_bytes: bytes = byte_array.toBase64().data()
 
             each_max = 1024 - 8 - 1
-            max_line = int(len(base64_string) / each_max)
-
-            for i in range(len(base64_string)):
-                if i == max_line * each_max:
-                    result += '\r;' + img_type + base64_string[i]
-                elif i == 0:
-                    result += img_type + base64_string[i]
-                elif i % each_max == 0:
-                    result += '\r' + img_type + base64_string[i]
-                else:
-                    result += base64_string[i]
+            max_line = len(base64_bytes) // each_max
+
+            result = cls._split_image_lines(base64_bytes, img_type, each_max, max_line)
 
         except Exception as e:
             raise e
@@ -496,5 +639,6 @@ if __name__ == "__main__":
     Init point of the script
     """
     thumbnail_generator: ElegooNeptuneThumbnails = ElegooNeptuneThumbnails()
-    if thumbnail_generator.is_supported_printer():
+    app: QApplication = QApplication.instance() or QApplication(sys.argv)  # QT needs it for painter.drawText
+    if not thumbnail_generator.has_thumbnail_prefix() and thumbnail_generator.is_supported_printer():
         thumbnail_generator.add_thumbnail_prefix()
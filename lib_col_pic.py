@@ -59,6 +59,7 @@ def ColPicEncode(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize,
     Listu16 = []
     for i in range(1024):
         Listu16.append(U16HEAD())
+    ListIndex = {}
 
     ListQty = 0
     enqty = 0
@@ -66,18 +67,10 @@ def ColPicEncode(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize,
     if colorsmax > 1024:
         colorsmax = 1024
     for i in range(dotsqty):
-        ListQty = ADList0(fromcolor16[i], Listu16, ListQty, 1024)
+        ListQty = ADList0(fromcolor16[i], Listu16, ListQty, 1024, ListIndex)
 
-    for index in range(1, ListQty):
-        l0 = Listu16[index]
-        for i in range(index):
-            if l0.qty >= Listu16[i].qty:
-                aListu16 = bListu16 = Listu16.copy()
-                for j in range(index - i):
-                    Listu16[i + j + 1] = aListu16[i + j]
-
-                Listu16[i] = l0
-                break
+    # Sort by qty descending, on equal qty later colors come first (same order as the original insertion sort)
+    Listu16[:ListQty] = sorted(reversed(Listu16[:ListQty]), key=lambda head: head.qty, reverse=True)
 
     while ListQty > colorsmax:
         l0 = Listu16[ListQty - 1]
@@ -104,8 +97,7 @@ def ColPicEncode(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize,
 
         ListQty = ListQty - 1
 
-    for n in range(len(outputdata)):
-        outputdata[n] = 0
+    outputdata[:] = bytes(len(outputdata))
 
     Head0.encodever = 3
     Head0.oncelistqty = 0
@@ -146,14 +138,14 @@ def ColPicEncode(fromcolor16, picw, pich, outputdata: bytearray, outputmaxtsize,
     return sizeofColPicHead3 + Head0.ListDataSize + Head0.ColorDataSize
 
 
-def ADList0(val, Listu16, ListQty, maxqty):
+def ADList0(val, Listu16, ListQty, maxqty, ListIndex):
     qty = ListQty
     if qty >= maxqty:
         return ListQty
-    for i in range(qty):
-        if Listu16[i].colo16 == val:
-            Listu16[i].qty += 1
-            return ListQty
+    i = ListIndex.get(val)
+    if i is not None:
+        Listu16[i].qty += 1
+        return ListQty
 
     A0 = val >> 11 & 31
     A1 = (val & 2016) >> 5
@@ -163,6 +155,7 @@ def ADList0(val, Listu16, ListQty, maxqty):
     Listu16[qty].A1 = A1
     Listu16[qty].A2 = A2
     Listu16[qty].qty = 1
+    ListIndex[val] = qty
     ListQty = qty + 1
     return ListQty
 
@@ -174,6 +167,11 @@ def Byte8bitEncode(fromcolor16, listu16Index, listqty, dotsqty, outputdata: byte
     decindex = 0
     lastid = 0
     temp = 0
+    listindex = {}
+    for i in range(listqty):
+        aa = listu16[i * 2 + 1 + listu16Index] << 8
+        aa |= listu16[i * 2 + 0 + listu16Index]
+        listindex.setdefault(aa, i)
     while dotsqty > 0:
         dots = 1
         for i in range(dotsqty - 1):
@@ -183,13 +181,7 @@ def Byte8bitEncode(fromcolor16, listu16Index, listqty, dotsqty, outputdata: byte
             if dots == 255:
                 break
 
-        temp = 0
-        for i in range(listqty):
-            aa = listu16[i * 2 + 1 + listu16Index] << 8
-            aa |= listu16[i * 2 + 0 + listu16Index]
-            if aa == fromcolor16[srcindex]:
-                temp = i
-                break
+        temp = listindex.get(fromcolor16[srcindex], 0)
 
         tid = int(temp % 32)
         if tid > 255: